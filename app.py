@@ -1,12 +1,19 @@
 # app.py — Streamlit UI (Supabase backend, with Customers, Suppliers, Payments, Products, Purchases/Sales)
 import os
+import numpy as np
 import pandas as pd
 import streamlit as st
-import hashlib, secrets
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except Exception:  # older/newer Streamlit layouts: threads still work, just log a context warning
+    add_script_run_ctx = get_script_run_ctx = None
 
-from pandas.api.types import is_datetime64tz_dtype
-from supabase_db import ensure_all_tabs, fetch_df, append_row, reset_or_create_user
+from supabase_db import (ensure_all_tabs, fetch_df, fetch_range, append_row, append_rows, reset_or_create_user, hash_password,
+                         verify_password, needs_rehash)
 
 # ===================== App Config / Auth =====================
 st.set_page_config(page_title="Tiles & Granite Inventory", layout="wide")
@@ -56,69 +63,133 @@ def _schedule_reset(*keys):
     pending.update(keys)
     st.session_state["_reset_keys"] = list(pending)
 
-# ===================== Ensure tables exist =====================
-try:
+# ===================== Ensure tables exist (once per process) =====================
+@st.cache_resource(show_spinner=False)
+def _ensure_tables_once() -> bool:
     ensure_all_tabs()
+    return True
+
+try:
+    _ensure_tables_once()
 except RuntimeError as e:
     st.warning(f"Supabase not configured yet: {e}")
 
 # ===================== Cached reads =====================
-@st.cache_data(ttl=12, show_spinner=False)
-def users_df():
-    df = fetch_df("users")
+# Seconds before a cached read is re-fetched. This session's own writes clear the affected caches at
+# once (_clear_caches), so the TTL only bounds how long other sessions' writes take to show up:
+# the name lists rarely change, while the ledgers move with every bill. Derived caches use the
+# shortest TTL among the tables they read.
+CACHE_TTL = {
+    "users":       30,
+    "products":    60,
+    "customers":   60,
+    "suppliers":   60,
+    "payments":    12,
+    "stock_moves": 12,
+}
+
+# st.cache_data hands every caller its own copy, so callers may add columns without .copy()
+def _zero_blanks(df: pd.DataFrame, cols) -> pd.DataFrame:
+    # supabase_db already typed the numeric columns; blank amounts/quantities count as 0 here
     if not df.empty:
-        df["id"] = pd.to_numeric(df["id"], errors="coerce").astype("Int64")
+        cols = list(cols)
+        df[cols] = df[cols].fillna(0.0)
     return df
 
-@st.cache_data(ttl=12, show_spinner=False)
+@st.cache_data(ttl=CACHE_TTL["users"], show_spinner=False)
+def users_df():
+    return fetch_df("users")
+
+@st.cache_data(ttl=CACHE_TTL["products"], show_spinner=False)
 def products_df():
-    df = fetch_df("products")
-    if not df.empty:
-        df["id"] = pd.to_numeric(df["id"], errors="coerce").astype("Int64")
-        df["opening_stock"] = pd.to_numeric(df["opening_stock"], errors="coerce").fillna(0.0)
-    return df
+    return _zero_blanks(fetch_df("products"), ("opening_stock",))
 
-@st.cache_data(ttl=12, show_spinner=False)
+@st.cache_data(ttl=CACHE_TTL["customers"], show_spinner=False)
 def customers_df():
-    df = fetch_df("customers")
-    if not df.empty:
-        df["id"] = pd.to_numeric(df["id"], errors="coerce").astype("Int64")
-    return df
+    return fetch_df("customers")
 
-@st.cache_data(ttl=12, show_spinner=False)
+@st.cache_data(ttl=CACHE_TTL["suppliers"], show_spinner=False)
 def suppliers_df():
-    df = fetch_df("suppliers")
-    if not df.empty:
-        df["id"] = pd.to_numeric(df["id"], errors="coerce").astype("Int64")
-    return df
+    return fetch_df("suppliers")
+
+def _typed_payments(df: pd.DataFrame) -> pd.DataFrame:
+    return _zero_blanks(df, ("amount",))
 
-@st.cache_data(ttl=12, show_spinner=False)
+def _typed_moves(df: pd.DataFrame) -> pd.DataFrame:
+    return _zero_blanks(df, ("qty", "price_per_unit"))
+
+@st.cache_data(ttl=CACHE_TTL["payments"], show_spinner=False)
 def payments_df():
-    df = fetch_df("payments")
-    if not df.empty:
-        df["id"] = pd.to_numeric(df["id"], errors="coerce").astype("Int64")
-        df["customer_id"] = pd.to_numeric(df["customer_id"], errors="coerce").astype("Int64")
-        df["amount"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0.0)
-    return df
+    return _typed_payments(fetch_df("payments"))
 
-@st.cache_data(ttl=12, show_spinner=False)
+@st.cache_data(ttl=CACHE_TTL["stock_moves"], show_spinner=False)
 def stock_moves_df():
-    df = fetch_df("stock_moves")
-    if not df.empty:
-        for col in ["id", "product_id", "customer_id"]:
-            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
-        df["qty"] = pd.to_numeric(df["qty"], errors="coerce").fillna(0.0)
-        df["price_per_unit"] = pd.to_numeric(df["price_per_unit"], errors="coerce").fillna(0.0)
-    return df
-
-def _clear_caches():
-    st.cache_data.clear()
+    return _typed_moves(fetch_df("stock_moves"))
+
+# ---- single-day slices, filtered by Supabase instead of scanning full history ----
+def _day_bounds(day: date) -> tuple[str, str]:
+    start = datetime(day.year, day.month, day.day)
+    return start.isoformat(timespec="seconds"), (start + timedelta(days=1)).isoformat(timespec="seconds")
+
+@st.cache_data(ttl=CACHE_TTL["payments"], show_spinner=False)
+def payments_on_day(day: date):
+    return _typed_payments(fetch_range("payments", "ts", *_day_bounds(day)))
+
+@st.cache_data(ttl=CACHE_TTL["stock_moves"], show_spinner=False)
+def stock_moves_on_day(day: date):
+    return _typed_moves(fetch_range("stock_moves", "ts", *_day_bounds(day)))
+
+# cached functions that read each table, directly or through another cached function; the
+# derived ones are added once defined (further down), the start-up bootstrap only writes users
+_CACHE_DEPS = {
+    "users":       (users_df,),
+    "products":    (products_df,),
+    "customers":   (customers_df,),
+    "suppliers":   (suppliers_df,),
+    "payments":    (payments_df, payments_on_day),
+    "stock_moves": (stock_moves_df, stock_moves_on_day),
+}
+
+def _clear_caches(*tables: str):
+    """Invalidate the caches that depend on the written tables (all caches when none given)."""
+    if not tables:
+        st.cache_data.clear()
+        return
+    for fn in {fn for t in tables for fn in _CACHE_DEPS[t]}:
+        fn.clear()
+
+def _warm_caches(ctx=None):
+    # the table reads are independent HTTPS round-trips; fill the caches concurrently.
+    # ctx is the script thread's run context (looked up here when called from the script thread)
+    readers = (products_df, customers_df, suppliers_df, payments_df, stock_moves_df)
+    if ctx is None and get_script_run_ctx:
+        ctx = get_script_run_ctx()
+
+    def _run(fn):
+        if ctx is not None:
+            add_script_run_ctx(ctx=ctx)
+        try:
+            fn()
+        except Exception:
+            pass  # the tab that needs it will fetch (and report) on its own
+
+    with ThreadPoolExecutor(max_workers=len(readers)) as ex:
+        list(ex.map(_run, readers))
+
+def _warm_caches_in_background():
+    # once per session, while the login form is on screen; the caches are process-wide,
+    # so the fetches are usually done by the time Login is pressed
+    if st.session_state.get("_warm_started"):
+        return
+    st.session_state["_warm_started"] = True
+    # captured here: the new thread has no context of its own to look up
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+    t = threading.Thread(target=_warm_caches, args=(ctx,), daemon=True)
+    if ctx is not None:
+        add_script_run_ctx(t, ctx)
+    t.start()
 
 # ===================== AUTH helpers =====================
-def _hash_password(password: str, salt: str) -> str:
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), 100_000)
-    return dk.hex()
-
 def user_exists(username: str) -> bool:
     df = users_df()
     if df.empty:
@@ -129,63 +200,93 @@ def user_exists(username: str) -> bool:
 
 def create_user(username: str, password: str):
     salt = secrets.token_hex(16)
-    pwd_hash = _hash_password(password, salt)
+    pwd_hash = hash_password(password, salt)
     append_row("users", [None, username.strip().lower(), pwd_hash, salt])
-    _clear_caches()
+    _clear_caches("users")
 
 def verify_login(username: str, password: str):
     username = username.strip().lower()
     if username not in ALLOWED_USERS:
         return None
-    df = users_df()
+    # read uncached on purpose: a login must see the hash as it is now (a reset from another
+    # process included), and it runs once per login press; only the credential columns travel,
+    # and usernames match case-insensitively, as in user_exists
+    df = fetch_df("users", columns=["username", "password_hash", "salt"])
     if df.empty:
         return None
-    row = df[df["username"].astype(str).str.lower() == username]
+    stored = df["username"].astype("string")
+    row = df[stored.str.lower().eq(username).fillna(False)]
     if row.empty:
         return None
-    row = row.iloc[0]
-    if _hash_password(password, row["salt"]) == row["password_hash"]:
-        return {"username": row["username"]}
-    return None
-
-if DEFAULT_USERNAME in ALLOWED_USERS and not user_exists(DEFAULT_USERNAME):
-    try:
-        create_user(DEFAULT_USERNAME, DEFAULT_PASSWORD)
-    except Exception:
-        pass
+    # a lowercase row (written by a reset) wins over an older mixed-case one
+    row = row.iloc[int(stored[row.index].eq(username).fillna(False).to_numpy().argmax())]
+    if not verify_password(password, row["salt"], row["password_hash"]):
+        return None
+    # the session keeps the user after this, so reruns never hash again; upgrade old work factors once
+    if needs_rehash(row["password_hash"]):
+        try:
+            reset_or_create_user(username, password)
+            _clear_caches("users")
+        except Exception:
+            pass
+    return {"username": row["username"]}
+
+if not st.session_state.get("_db_ready"):
+    if DEFAULT_USERNAME in ALLOWED_USERS and not user_exists(DEFAULT_USERNAME):
+        try:
+            create_user(DEFAULT_USERNAME, DEFAULT_PASSWORD)
+        except Exception:
+            pass
+    st.session_state["_db_ready"] = True
 
 # ===================== Data helpers =====================
-def list_products():
+# selectbox option maps, built column-wise instead of via one record dict per row;
+# cached so the Purchase, Sale and Payments tabs share one build per data change
+@st.cache_data(ttl=CACHE_TTL["products"], show_spinner=False)
+def product_choices() -> dict:
+    """label -> (id, unit)"""
     df = products_df()
-    return [] if df.empty else df.to_dict(orient="records")
-
-def list_customers():
+    if df.empty:
+        return {}
+    labels = (df["name"].astype(str) + " (" + df["size"].fillna("").astype(str)
+              + " | " + df["unit"].fillna("").astype(str) + ")")
+    return dict(zip(labels, zip(df["id"], df["unit"])))
+
+@st.cache_data(ttl=CACHE_TTL["customers"], show_spinner=False)
+def customer_choices() -> dict:
+    """name -> id"""
     df = customers_df()
-    return [] if df.empty else df.to_dict(orient="records")
+    return {} if df.empty else dict(zip(df["name"], df["id"]))
 
-def list_suppliers():
+@st.cache_data(ttl=CACHE_TTL["suppliers"], show_spinner=False)
+def supplier_choices() -> dict:
+    """name -> id"""
     df = suppliers_df()
-    return [] if df.empty else df.to_dict(orient="records")
-
-def _get_opening_stock(product_id: int) -> float:
-    df = products_df()
-    if df.empty:
-        return 0.0
-    row = df[df["id"] == product_id]
-    if row.empty:
-        return 0.0
-    return float(row.iloc[0]["opening_stock"] or 0.0)
+    return {} if df.empty else dict(zip(df["name"], df["id"]))
 
 def product_stock(product_id: int) -> float:
-    opening = _get_opening_stock(product_id)
+    df = products_with_stock()
+    row = df.loc[df["id"] == product_id, "current_stock"]
+    return float(row.iloc[0]) if not row.empty else 0.0
+
+@st.cache_data(ttl=CACHE_TTL["stock_moves"], show_spinner=False)
+def products_with_stock():
+    """products + current_stock (opening_stock + Σ qty of its moves), one groupby for all products."""
+    df = products_df()
     moves = stock_moves_df()
-    if moves.empty:
-        return float(opening)
-    s = float(moves[moves["product_id"] == product_id]["qty"].sum() or 0.0)
-    return float(opening) + s
+    moved = moves.groupby("product_id")["qty"].sum() if not moves.empty else pd.Series(dtype="float64")
+    df["current_stock"] = df["opening_stock"] + df["id"].map(moved).fillna(0.0)
+    return df
+
+def _inserted_id(rec) -> int | None:
+    try:
+        return int(rec["id"])
+    except (TypeError, KeyError, ValueError):
+        return None
 
-def add_product(name, material, size, unit, opening_stock):
-    append_row("products", [
+def add_product(name, material, size, unit, opening_stock) -> int | None:
+    """Returns the new product id (None if the backend did not echo it)."""
+    rec = append_row("products", [
         None,
         (name or "").strip(),
         (material or "").strip() or None,
@@ -193,28 +294,28 @@ def add_product(name, material, size, unit, opening_stock):
         (unit or "").strip(),
         float(opening_stock or 0.0)
     ])
-    _clear_caches()
-    return True
+    _clear_caches("products")
+    return _inserted_id(rec)
 
-def add_customer(name, phone, address):
-    append_row("customers", [
+def add_customer(name, phone, address) -> int | None:
+    rec = append_row("customers", [
         None,
         (name or "").strip(),
         (phone or "").strip() or None,
         (address or "").strip() or None
     ])
-    _clear_caches()
-    return True
+    _clear_caches("customers")
+    return _inserted_id(rec)
 
-def add_supplier(name, phone, address):
-    append_row("suppliers", [
+def add_supplier(name, phone, address) -> int | None:
+    rec = append_row("suppliers", [
         None,
         (name or "").strip(),
         (phone or "").strip() or None,
         (address or "").strip() or None
     ])
-    _clear_caches()
-    return True
+    _clear_caches("suppliers")
+    return _inserted_id(rec)
 
 def add_payment(customer_id: int | None, kind: str, amount: float,
                 supplier_id: int | None = None, notes: str = None,
@@ -232,135 +333,186 @@ def add_payment(customer_id: int | None, kind: str, amount: float,
             str(kind),
             float(amount),
             (notes or None)
-        ])
+        ], returning="minimal")
     except Exception as e:
         st.error(f"Supabase insert failed: {e}")
         return False
-    _clear_caches()
+    _clear_caches("payments")
     return True
 
-def add_move(kind, product_id, qty, price_per_unit=None, customer_id=None, supplier_id=None, notes=None,
-             when: datetime | None = None, dedupe_window_seconds: int = 120) -> bool:
+def _recent_move_signatures(ts_dt: datetime, window_seconds: int) -> set:
+    # only the window [since, ts_dt] is fetched (half-open upper bound one second past ts_dt)
+    since = ts_dt - timedelta(seconds=window_seconds)
+    df = fetch_range("stock_moves", "ts",
+                     since.isoformat(timespec="seconds"),
+                     (ts_dt + timedelta(seconds=1)).isoformat(timespec="seconds"))
+    if df.empty:
+        return set()
+    return set(zip(
+        df["kind"].astype("string").fillna(""),
+        df["product_id"],
+        df["qty"],
+        df["price_per_unit"].fillna(0.0),
+        df["customer_id"].fillna(-1),
+        df["notes"].astype("string").fillna(""),
+    ))
+
+def add_moves(moves: list, when: datetime | None = None, dedupe_window_seconds: int = 120) -> int:
+    """
+    Record several stock moves (dicts of add_move's arguments) with one insert.
+    Lines matching a move saved within the dedupe window, or an earlier line of the
+    same batch, are skipped. Returns the number of moves saved.
+    """
     ts_dt = (when or datetime.now())
-    ins_qty = -qty if (kind == "sale" and qty > 0) else qty
-
-    if dedupe_window_seconds and dedupe_window_seconds > 0:
-        since = ts_dt - timedelta(seconds=dedupe_window_seconds)
-        df = stock_moves_df()
-        if not df.empty:
-            df = df.copy()
-            df["ts_dt"] = pd.to_datetime(df["ts"], errors="coerce")
-            kind_match  = df["kind"].astype("string").fillna("").eq((kind or ""))
-            pid_match   = pd.to_numeric(df["product_id"], errors="coerce").eq(int(product_id))
-            qty_match   = pd.to_numeric(df["qty"], errors="coerce").eq(float(ins_qty))
-            ppu_match   = pd.to_numeric(df["price_per_unit"], errors="coerce").fillna(0.0).eq(float(price_per_unit or 0.0))
-            cust_match  = pd.to_numeric(df["customer_id"], errors="coerce").fillna(-1).eq(int(customer_id) if customer_id is not None else -1)
-            notes_match = df["notes"].astype("string").fillna("").eq((notes or ""))
-            mask = ((df["ts_dt"] >= since) & kind_match & pid_match & qty_match & ppu_match & cust_match & notes_match).fillna(False)
-            if not df[mask].empty:
-                return False
-
     ts = ts_dt.isoformat(timespec="seconds")
-    append_row("stock_moves", [
-    None, ts, kind, int(product_id), float(ins_qty),
-    (float(price_per_unit) if price_per_unit not in (None, "") else None),
-    (int(customer_id) if customer_id not in (None, "") else None),
-    (notes or None)
-])
+    dedupe = bool(dedupe_window_seconds and dedupe_window_seconds > 0)
+    seen = _recent_move_signatures(ts_dt, dedupe_window_seconds) if dedupe else set()
+
+    rows = []
+    for m in moves:
+        kind, qty = m["kind"], m["qty"]
+        price_per_unit, customer_id, notes = m.get("price_per_unit"), m.get("customer_id"), m.get("notes")
+        ins_qty = -qty if (kind == "sale" and qty > 0) else qty
+        if dedupe:
+            sig = (kind or "", int(m["product_id"]), float(ins_qty), float(price_per_unit or 0.0),
+                   int(customer_id) if customer_id is not None else -1, notes or "")
+            if sig in seen:
+                continue
+            seen.add(sig)
+        rows.append([
+            None, ts, kind, int(m["product_id"]), float(ins_qty),
+            (float(price_per_unit) if price_per_unit not in (None, "") else None),
+            (int(customer_id) if customer_id not in (None, "") else None),
+            (notes or None)
+        ])
 
-    _clear_caches()
-    return True
+    if rows:
+        append_rows("stock_moves", rows, returning="minimal")
+        _clear_caches("stock_moves")
+    return len(rows)
+
+def add_move(kind, product_id, qty, price_per_unit=None, customer_id=None, supplier_id=None, notes=None,
+             when: datetime | None = None, dedupe_window_seconds: int = 120) -> bool:
+    move = {"kind": kind, "product_id": product_id, "qty": qty, "price_per_unit": price_per_unit,
+            "customer_id": customer_id, "supplier_id": supplier_id, "notes": notes}
+    return add_moves([move], when=when, dedupe_window_seconds=dedupe_window_seconds) == 1
 
 def products_lookup_key(name: str, size: str, unit: str):
     return (name or "").strip().lower(), (size or "").strip().lower(), (unit or "").strip()
 
-def get_product_by_name_size_unit(name: str, size: str, unit: str):
+def _cell(v) -> str:
+    return "" if _is_na(v) else str(v)
+
+def _is_na(v) -> bool:
+    try:
+        return bool(pd.isna(v))
+    except (TypeError, ValueError):
+        return False
+
+# ---- key -> id indexes, built once per cache generation instead of re-scanning per lookup ----
+@st.cache_data(ttl=CACHE_TTL["products"], show_spinner=False)
+def _product_index() -> dict:
     df = products_df()
+    idx = {}
+    if df.empty:
+        return idx
+    for pid, n, s, u in zip(df["id"], df["name"], df["size"], df["unit"]):
+        if _is_na(pid):
+            continue
+        idx.setdefault((_cell(n).lower(), _cell(s).lower(), _cell(u)), int(pid))
+    return idx
+
+def _name_index(df: pd.DataFrame) -> dict:
+    idx = {}
     if df.empty:
+        return idx
+    for rid, n in zip(df["id"], df["name"]):
+        if _is_na(rid):
+            continue
+        idx.setdefault(str(n).lower(), int(rid))
+    return idx
+
+@st.cache_data(ttl=CACHE_TTL["customers"], show_spinner=False)
+def _customer_index() -> dict:
+    return _name_index(customers_df())
+
+@st.cache_data(ttl=CACHE_TTL["suppliers"], show_spinner=False)
+def _supplier_index() -> dict:
+    return _name_index(suppliers_df())
+
+def get_product_by_name_size_unit(name: str, size: str, unit: str):
+    pid = _product_index().get(products_lookup_key(name, size, unit))
+    if pid is None:
         return None
-    n, s, u = products_lookup_key(name, size, unit)
-    mask = (
-        df["name"].astype("string").str.lower().fillna("").eq(n) &
-        df["unit"].astype("string").fillna("").eq(u) &
-        df["size"].astype("string").str.lower().fillna("").eq(s)
-    ).fillna(False)
-    row = df[mask]
+    df = products_df()
+    row = df[df["id"] == pid]
     return None if row.empty else row.iloc[0].to_dict()
 
 def ensure_product(name: str, size: str, unit: str, material: str = None, opening_stock: float = 0.0):
-    p = get_product_by_name_size_unit(name, size, unit)
-    if p:
-        return int(p["id"])
-    add_product(name=name, material=material, size=size, unit=unit, opening_stock=opening_stock)
-    df = products_df()
-    n, s, u = products_lookup_key(name, size, unit)
-    row = df[
-        df["name"].astype("string").str.lower().eq(n) &
-        df["unit"].astype("string").eq(u) &
-        df["size"].astype("string").str.lower().eq(s)
-    ]
-    return int(row.iloc[0]["id"]) if not row.empty else None
+    key = products_lookup_key(name, size, unit)
+    pid = _product_index().get(key)
+    if pid is not None:
+        return pid
+    pid = add_product(name=name, material=material, size=size, unit=unit, opening_stock=opening_stock)
+    return pid if pid is not None else _product_index().get(key)
 
 def ensure_customer_by_name(name: str, phone: str = None, address: str = None):
     nm = (name or "").strip()
     if not nm:
         return None
-    df = customers_df()
-    if not df.empty:
-        row = df[df["name"].astype(str).str.lower() == nm.lower()]
-        if not row.empty:
-            return int(row.iloc[0]["id"])
-    add_customer(nm, phone, address)
-    df = customers_df()
-    row = df[df["name"].astype(str).str.lower() == nm.lower()]
-    return int(row.iloc[0]["id"]) if not row.empty else None
+    cid = _customer_index().get(nm.lower())
+    if cid is not None:
+        return cid
+    cid = add_customer(nm, phone, address)
+    return cid if cid is not None else _customer_index().get(nm.lower())
 
 def ensure_supplier_by_name(name: str, phone: str = None, address: str = None):
     nm = (name or "").strip()
     if not nm:
         return None
-    df = suppliers_df()
-    if not df.empty:
-        row = df[df["name"].astype(str).str.lower() == nm.lower()]
-        if not row.empty:
-            return int(row.iloc[0]["id"])
-    add_supplier(nm, phone, address)
-    df = suppliers_df()
-    row = df[df["name"].astype(str).str.lower() == nm.lower()]
-    return int(row.iloc[0]["id"]) if not row.empty else None
-
-def _normalize_ts(series: pd.Series) -> pd.Series:
-    s = pd.to_datetime(series, errors="coerce")
-    if is_datetime64tz_dtype(s):
-        s = s.dt.tz_localize(None)
-    return s
+    sid = _supplier_index().get(nm.lower())
+    if sid is not None:
+        return sid
+    sid = add_supplier(nm, phone, address)
+    return sid if sid is not None else _supplier_index().get(nm.lower())
+
+def _hhmm(ts: pd.Series) -> pd.Series:
+    # ISO timestamps ("YYYY-MM-DDTHH:MM:SS...") keep the wall-clock time at a fixed offset,
+    # so slicing avoids a full datetime parse
+    return ts.astype("string").str.slice(11, 16)
 # ---- Balances & parsing helpers (MUST be defined before UI uses them) ----
-def customer_balance(customer_id: int) -> float:
+@st.cache_data(ttl=CACHE_TTL["stock_moves"], show_spinner=False)
+def customer_balances() -> pd.Series:
     """
+    customer id -> outstanding, for every customer in one groupby pass:
     Outstanding = Σ(sales amount) + Σ(opening_due) − Σ(payments) − Σ(advances).
     Negative means advance/credit available.
     """
-    if not customer_id:
-        return 0.0
-
     mv = stock_moves_df()
-    sales_total = 0.0
+    sales = pd.Series(dtype="float64")
     if not mv.empty:
-        s = mv[(mv["kind"] == "sale") & (mv["customer_id"] == int(customer_id))].copy()
-        if not s.empty:
-            s["price_per_unit"] = pd.to_numeric(s["price_per_unit"], errors="coerce").fillna(0.0)
-            s["qty"] = pd.to_numeric(s["qty"], errors="coerce").fillna(0.0).abs()
-            sales_total = float((s["qty"] * s["price_per_unit"]).sum())
+        s = mv[mv["kind"] == "sale"]
+        sales = (s["qty"].abs() * s["price_per_unit"]).groupby(s["customer_id"]).sum()
 
     pay = payments_df()
-    opening_due = payments = advances = 0.0
+    paid = pd.Series(dtype="float64")
     if not pay.empty:
-        p = pay[pay["customer_id"] == int(customer_id)]
-        opening_due = float(pd.to_numeric(p[p["kind"] == "opening_due"]["amount"], errors="coerce").fillna(0.0).sum())
-        payments    = float(pd.to_numeric(p[p["kind"] == "payment"]["amount"],     errors="coerce").fillna(0.0).sum())
-        advances    = float(pd.to_numeric(p[p["kind"] == "advance"]["amount"],     errors="coerce").fillna(0.0).sum())
+        sign = pay["kind"].map({"opening_due": 1.0, "payment": -1.0, "advance": -1.0}).fillna(0.0)
+        paid = (pay["amount"] * sign).groupby(pay["customer_id"]).sum()
 
-    return round(sales_total + opening_due - payments - advances, 2)
+    return sales.add(paid, fill_value=0.0).round(2)
+
+def customer_balance(customer_id: int) -> float:
+    if not customer_id:
+        return 0.0
+    return float(customer_balances().get(int(customer_id), 0.0))
+
+# derived caches, registered now that they are all defined (before any UI write can run)
+_CACHE_DEPS["products"] += (product_choices, products_with_stock, _product_index)
+_CACHE_DEPS["customers"] += (customer_choices, _customer_index)
+_CACHE_DEPS["suppliers"] += (supplier_choices, _supplier_index)
+_CACHE_DEPS["payments"] += (customer_balances,)
+_CACHE_DEPS["stock_moves"] += (products_with_stock, customer_balances)
 
 def parse_amount(txt: str) -> float | None:
     """
@@ -404,6 +556,7 @@ st.title("Tiles & Granite Inventory")
 
 # ---- LOGIN WALL ----
 if "user" not in st.session_state:
+    _warm_caches_in_background()
     with st.expander("🔐 Login", expanded=True):
         u = st.text_input("Username")
         p = st.text_input("Password", type="password")
@@ -414,6 +567,7 @@ if "user" not in st.session_state:
                 user = verify_login(u, p)
                 if user:
                     st.session_state.user = user
+                    _warm_caches()
                     st.rerun()
                 else:
                     st.error("Invalid credentials.")
@@ -421,7 +575,7 @@ if "user" not in st.session_state:
             if st.button("Reset default user (fix login)", key="btn_reset_default"):
                 try:
                     reset_or_create_user(DEFAULT_USERNAME, DEFAULT_PASSWORD)
-                    st.cache_data.clear()
+                    _clear_caches("users")
                     st.success("Default user reset. Try: username 'venkat reddy', password '1234'.")
                 except Exception as e:
                     st.error(f"Reset failed: {e}")
@@ -441,18 +595,37 @@ with top_right:
 DEFAULT_UNIT_OPTIONS = ["box", "pcs", "sq_ft", "bag", "kg"]
 DEFAULT_MATERIAL_OPTIONS = ["Tiles", "Granite", "Marble", "Other"]
 
+# row field -> widget key suffix (widget keys are f"{session_key}_{suffix}_{row_id}")
+ROW_FIELDS = {"material": "mat", "product_name": "name", "size": "size", "unit": "unit", "qty": "qty", "rate": "rate"}
+
+def _new_row() -> dict:
+    # "_id" keys the row's widgets, so they keep their state when sibling rows come and go
+    row = {field: "" for field in ROW_FIELDS}
+    row["_id"] = secrets.token_hex(4)
+    return row
+
+def _blank_rows(n: int = 6) -> list:
+    return [_new_row() for _ in range(n)]
+
 def ensure_rows(session_key: str, start_rows: int = 6):
     if session_key not in st.session_state:
-        st.session_state[session_key] = [
-            {"material":"","product_name":"","size":"","unit":"","qty":"","rate":""} for _ in range(start_rows)
-        ]
+        st.session_state[session_key] = _blank_rows(start_rows)
 
-def _row_amount(qty_txt: str, rate_txt: str) -> float:
+def _to_float(txt: str) -> float:
     try:
-        return float(qty_txt) * float(rate_txt)
-    except:
+        return float(txt)
+    except (TypeError, ValueError):
         return 0.0
 
+def _row_amount(qty_txt: str, rate_txt: str) -> float:
+    return _to_float(qty_txt) * _to_float(rate_txt)
+
+def _subtotal(rows: list) -> float:
+    n = len(rows)
+    qtys = np.fromiter((_to_float(r["qty"]) for r in rows), dtype=np.float64, count=n)
+    rates = np.fromiter((_to_float(r["rate"]) for r in rows), dtype=np.float64, count=n)
+    return float(np.dot(qtys, rates))
+
 def row_form(session_key: str, title: str):
     ensure_rows(session_key)
     rows = st.session_state[session_key]
@@ -462,13 +635,11 @@ def row_form(session_key: str, title: str):
     c1, c2, _ = st.columns([1,1,6])
     with c1:
         if st.button("➕ Add row", key=f"add_{session_key}"):
-            rows.append({"material":"","size":"","product_name":"","unit":"","qty":"","rate":""})
+            rows.append(_new_row())
             st.rerun()
     with c2:
         if st.button("🧹 Clear", key=f"clear_{session_key}"):
-            st.session_state[session_key] = [
-                {"material":"","product_name":"","size":"","unit":"","qty":"","rate":""} for _ in range(6)
-            ]
+            st.session_state[session_key] = _blank_rows()
             st.rerun()
     st.caption("Tip: type freely; the table won’t refresh until you click **Update Items**.")
 
@@ -486,7 +657,11 @@ def row_form(session_key: str, title: str):
         labs[5].markdown("**Rate**")
         labs[6].markdown("**Amount**")
 
-        for i, r in enumerate(rows):
+        row_keys = []
+        for r in rows:
+            row_id = r.setdefault("_id", secrets.token_hex(4))
+            keys = {field: f"{session_key}_{suffix}_{row_id}" for field, suffix in ROW_FIELDS.items()}
+            row_keys.append((row_id, keys))
             cols = st.columns([1.1, 1.1, 2, 0.9, 0.8, 0.9, 1.1])
 
             mat_current = (r.get("material") or "").strip()
@@ -496,13 +671,13 @@ def row_form(session_key: str, title: str):
             with cols[0]:
                 st.selectbox("", options=mat_options,
                              index=mat_options.index(mat_current) if mat_current in mat_options else 0,
-                             key=f"{session_key}_mat_{i}")
+                             key=keys["material"])
 
             with cols[1]:
-                st.text_input("", value=r.get("size",""), key=f"{session_key}_size_{i}", placeholder="e.g., 600x600")
+                st.text_input("", value=r.get("size",""), key=keys["size"], placeholder="e.g., 600x600")
 
             with cols[2]:
-                st.text_input("", value=r.get("product_name",""), key=f"{session_key}_name_{i}", placeholder="e.g., Renite")
+                st.text_input("", value=r.get("product_name",""), key=keys["product_name"], placeholder="e.g., Renite")
 
             unit_current = (r.get("unit") or "").strip()
             unit_options = DEFAULT_UNIT_OPTIONS.copy()
@@ -511,43 +686,29 @@ def row_form(session_key: str, title: str):
             with cols[3]:
                 st.selectbox("", options=unit_options,
                              index=unit_options.index(unit_current) if unit_current in unit_options else 0,
-                             key=f"{session_key}_unit_{i}")
+                             key=keys["unit"])
 
             with cols[4]:
-                st.text_input("", value=r.get("qty",""), key=f"{session_key}_qty_{i}", placeholder="")
+                st.text_input("", value=r.get("qty",""), key=keys["qty"], placeholder="")
 
             with cols[5]:
-                st.text_input("", value=r.get("rate",""), key=f"{session_key}_rate_{i}", placeholder="")
+                st.text_input("", value=r.get("rate",""), key=keys["rate"], placeholder="")
 
-            qty_widget_val = st.session_state.get(f"{session_key}_qty_{i}", r.get("qty",""))
-            rate_widget_val = st.session_state.get(f"{session_key}_rate_{i}", r.get("rate",""))
+            qty_widget_val = st.session_state.get(keys["qty"], r.get("qty",""))
+            rate_widget_val = st.session_state.get(keys["rate"], r.get("rate",""))
             amt = _row_amount(qty_widget_val, rate_widget_val)
             with cols[6]:
                 st.markdown(f"<div style='padding-top:6px;font-weight:600'>₹ {amt:,.2f}</div>", unsafe_allow_html=True)
 
         submitted = st.form_submit_button("Update Items")
         if submitted:
-            subtotal = 0.0
-            new_rows = []
-            for i, _ in enumerate(rows):
-                mat   = st.session_state.get(f"{session_key}_mat_{i}", "").strip()
-                size  = st.session_state.get(f"{session_key}_size_{i}", "").strip()
-                name  = st.session_state.get(f"{session_key}_name_{i}", "").strip()
-                unit  = st.session_state.get(f"{session_key}_unit_{i}", "").strip()
-                qty   = st.session_state.get(f"{session_key}_qty_{i}", "").strip()
-                rate  = st.session_state.get(f"{session_key}_rate_{i}", "").strip()
-                new_rows.append({
-                    "material": mat,
-                    "product_name": name,
-                    "size": size,
-                    "unit": unit,
-                    "qty": qty,
-                    "rate": rate
-                })
-                subtotal += _row_amount(qty, rate)
-            st.session_state[session_key] = new_rows if new_rows else [
-                {"material":"","product_name":"","size":"","unit":"","qty":"","rate":""} for _ in range(6)
+            state = st.session_state
+            new_rows = [
+                {**{field: (state.get(k) or "").strip() for field, k in keys.items()}, "_id": row_id}
+                for row_id, keys in row_keys
             ]
+            subtotal = _subtotal(new_rows)
+            st.session_state[session_key] = new_rows if new_rows else _blank_rows()
             st.session_state[subtotal_key] = subtotal
             st.rerun()
 
@@ -584,16 +745,8 @@ with tabs[0]:
     st.subheader("All Customers (with balance)")
     custs_df = customers_df()
     if not custs_df.empty:
-        show = custs_df.copy()
-
-        # local wrapper avoids scoping glitches and handles errors
-        def _safe_balance(cid) -> float:
-            try:
-                return customer_balance(int(cid))
-            except Exception:
-                return 0.0
-
-        show["Balance (+due / −adv)"] = show["id"].apply(_safe_balance)
+        show = custs_df
+        show["Balance (+due / −adv)"] = show["id"].map(customer_balances()).fillna(0.0)
         st.dataframe(
             show[["id","name","phone","address","Balance (+due / −adv)"]],
             use_container_width=True
@@ -620,7 +773,7 @@ with tabs[1]:
     st.subheader("All Suppliers (with balance)")
     sups_df = suppliers_df()
     if not sups_df.empty:
-        show = sups_df.copy()
+        show = sups_df
         def _safe_sup_balance(sid) -> float:
             try:
                 return supplier_balance(int(sid))
@@ -637,25 +790,24 @@ with tabs[1]:
 # ===================== Purchase (IN) =====================
 with tabs[2]:
     st.subheader("Record Purchase (single line)")
-    prods = list_products()
-    sups = list_suppliers()
+    prod_map = product_choices()
+    sup_map = supplier_choices()
 
-    if not prods:
+    if not prod_map:
         st.info("No products yet — Quick Bill below can auto-create products.")
     else:
-        prod_map = {f'{p["name"]} ({p.get("size") or ""} | {p["unit"]})': p for p in prods}
         choice = st.selectbox("Product*", list(prod_map.keys()), key="purchase_product")
-        p = prod_map[choice]
+        pid, unit = prod_map[choice]
+        pid = int(pid)
 
-        qty_text = st.text_input(f"Quantity ({p['unit']})*", key="purchase_qty", placeholder="")
+        qty_text = st.text_input(f"Quantity ({unit})*", key="purchase_qty", placeholder="")
         price_text = st.text_input("Price per unit (optional)", key="purchase_price", placeholder="")
 
         supplier_id = None
-        if sups:
-            sup_map = {s["name"]: s for s in sups}
+        if sup_map:
             sel = st.selectbox("Supplier (optional)", ["-- none --"] + list(sup_map.keys()), key="purchase_supplier")
             if sel != "-- none --":
-                supplier_id = int(sup_map[sel]["id"])
+                supplier_id = int(sup_map[sel])
 
         notes = st.text_input("Notes", key="purchase_notes", placeholder="Bill no / supplier / remarks")
 
@@ -668,7 +820,7 @@ with tabs[2]:
             if qty <= 0:
                 st.error("Quantity must be > 0.")
             else:
-                ok = add_move("purchase", int(p["id"]), qty, price_per_unit=(price or None),
+                ok = add_move("purchase", pid, qty, price_per_unit=(price or None),
                               supplier_id=supplier_id, notes=notes or None)
                 if ok:
                     st.success("Purchase saved.")
@@ -677,7 +829,7 @@ with tabs[2]:
                 _schedule_reset("purchase_qty","purchase_price","purchase_notes","purchase_supplier")
                 st.rerun()
 
-        st.caption(f"Current stock: **{product_stock(int(p['id']))} {p['unit']}**")
+        st.caption(f"Current stock: **{product_stock(pid)} {unit}**")
 
     # ---- Quick Bill (row form) ----
     st.divider()
@@ -699,8 +851,9 @@ with tabs[2]:
             mat_default  = first_non_blank(rows_in, "material", "Tiles")
             supplier_id = ensure_supplier_by_name(supplier_name) if supplier_name else None
 
-            saved = 0
+            moves = []
             created_only = 0
+            note = f"Bill {bill_no_in}" if bill_no_in else None
             for ln in rows_in:
                 name = (ln.get("product_name") or "").strip()
                 size = (ln.get("size") or "").strip()
@@ -714,21 +867,19 @@ with tabs[2]:
                 pid = ensure_product(name, size=size, unit=unit, material=material)
 
                 if qty > 0:
-                    note = f"Bill {bill_no_in}" if bill_no_in else None
-                    if add_move("purchase", pid, qty, price_per_unit=(rate or None),
-                                supplier_id=supplier_id, notes=(note or None)):
-                        saved += 1
+                    moves.append({"kind": "purchase", "product_id": pid, "qty": qty, "price_per_unit": (rate or None),
+                                  "supplier_id": supplier_id, "notes": note})
                 else:
                     created_only += 1
 
+            saved = add_moves(moves)
+
             if saved or created_only:
                 parts = []
                 if saved: parts.append(f"Saved {saved} purchase line(s)")
                 if created_only: parts.append(f"created {created_only} new product(s) at 0 stock")
                 st.success(", ".join(parts) + ".")
-                st.session_state["rows_purchase"] = [
-                    {"material":"","product_name":"","size":"","unit":"","qty":"","rate":""} for _ in range(6)
-                ]
+                st.session_state["rows_purchase"] = _blank_rows()
                 _schedule_reset("bill_no_in","supplier_in")
                 st.rerun()
             else:
@@ -739,26 +890,26 @@ with tabs[2]:
 # ===================== Sale (OUT) =====================
 with tabs[3]:
     st.subheader("Record Sale (single line)")
-    prods = list_products()
-    custs = list_customers()
-    if not prods:
+    prod_map = product_choices()
+    cust_map = customer_choices()
+    if not prod_map:
         st.info("No products yet — Quick Bill below can auto-create products.")
     else:
-        prod_map = {f'{p["name"]} ({p.get("size") or ""} | {p["unit"]})': p for p in prods}
         choice = st.selectbox("Product*", list(prod_map.keys()), key="sale_product")
-        p = prod_map[choice]
-        stock_now = product_stock(int(p["id"]))
+        pid, unit = prod_map[choice]
+        pid = int(pid)
+        stock_now = product_stock(pid)
 
-        qty_text = st.text_input(f"Quantity to sell ({p['unit']})*", key="sale_qty", placeholder="")
+        qty_text = st.text_input(f"Quantity to sell ({unit})*", key="sale_qty", placeholder="")
         price_text = st.text_input("Selling price per unit (optional)", key="sale_price", placeholder="")
 
         customer_id = None
+        prev_bal = 0.0
         adv_now = 0.0
-        if custs:
-            cust_map = {c["name"]: c for c in custs}
+        if cust_map:
             sel = st.selectbox("Customer (optional)", ["-- none --"] + list(cust_map.keys()), key="sale_customer")
             if sel != "-- none --":
-                customer_id = int(cust_map[sel]["id"])
+                customer_id = int(cust_map[sel])
                 prev_bal = customer_balance(customer_id)
                 if prev_bal >= 0:
                     st.info(f"**Prev. balance for {sel}: ₹ {prev_bal:,.2f} (due)**")
@@ -776,7 +927,7 @@ with tabs[3]:
         st.markdown(f"<div class='amount'>Line Total: ₹ {line_total:,.2f}</div>", unsafe_allow_html=True)
 
         if customer_id:
-            new_bal = customer_balance(customer_id) + line_total - float(adv_now or 0)
+            new_bal = prev_bal + line_total - float(adv_now or 0)
             st.caption(f"New balance after this line & advance: **₹ {new_bal:,.2f}**")
 
         if st.button("Save Sale"):
@@ -785,7 +936,7 @@ with tabs[3]:
             if qty <= 0:
                 st.error("Quantity must be > 0.")
             else:
-                ok = add_move("sale", int(p["id"]), qty, price_per_unit=(price or None),
+                ok = add_move("sale", pid, qty, price_per_unit=(price or None),
                               customer_id=customer_id, notes=notes or None)
                 if ok:
                     if customer_id and adv_now and adv_now > 0:
@@ -800,9 +951,9 @@ with tabs[3]:
                 st.rerun()
 
         if stock_now < 0:
-            st.caption(f"<span class='negative'>Current stock: {stock_now} {p['unit']} (negative)</span>", unsafe_allow_html=True)
+            st.caption(f"<span class='negative'>Current stock: {stock_now} {unit} (negative)</span>", unsafe_allow_html=True)
         else:
-            st.caption(f"Current stock: **{stock_now} {p['unit']}**")
+            st.caption(f"Current stock: **{stock_now} {unit}**")
 
     st.divider()
     st.markdown("### 🧾 Quick Bill Entry — Sale (multiple items)")
@@ -810,11 +961,10 @@ with tabs[3]:
     cust_out_name = st.text_input("Customer Name (optional)", key="customer_out")
 
     cust_preview_id = None
-    cdf = customers_df()
-    if not cdf.empty and (cust_out_name or "").strip():
-        row = cdf[cdf["name"].astype(str).str.lower() == cust_out_name.strip().lower()]
-        if not row.empty:
-            cust_preview_id = int(row.iloc[0]["id"])
+    bal = 0.0
+    if (cust_out_name or "").strip():
+        cust_preview_id = _customer_index().get(cust_out_name.strip().lower())
+        if cust_preview_id is not None:
             bal = customer_balance(cust_preview_id)
             if bal >= 0:
                 st.info(f"Prev. balance: ₹ {bal:,.2f}")
@@ -829,7 +979,7 @@ with tabs[3]:
 
     rows_out, subtotal_out = row_form("rows_sale", "Items")
     if cust_preview_id is not None:
-        preview_new_bal = customer_balance(cust_preview_id) + float(subtotal_out or 0) - float(bill_adv or 0)
+        preview_new_bal = bal + float(subtotal_out or 0) - float(bill_adv or 0)
         st.caption(f"New balance after this bill & advance: **₹ {preview_new_bal:,.2f}**")
 
     if st.button("Save Sales Bill", key="save_sales_bill"):
@@ -845,7 +995,8 @@ with tabs[3]:
             mat_default = first_non_blank(rows_out, "material", "Tiles")
             cust_id = ensure_customer_by_name(cust_out_name)
 
-            saved = 0
+            moves = []
+            note = f"Bill {bill_no_out}" if bill_no_out else None
             for ln in rows_out:
                 name = (ln.get("product_name") or "").strip()
                 size = (ln.get("size") or "").strip()
@@ -858,10 +1009,10 @@ with tabs[3]:
                 if qty <= 0:
                     continue
                 pid = ensure_product(name, size=size, unit=unit, material=material)
-                note = f"Bill {bill_no_out}" if bill_no_out else None
-                if add_move("sale", pid, qty, price_per_unit=(rate or None),
-                            customer_id=cust_id, notes=(note or None)):
-                    saved += 1
+                moves.append({"kind": "sale", "product_id": pid, "qty": qty, "price_per_unit": (rate or None),
+                              "customer_id": cust_id, "notes": note})
+
+            saved = add_moves(moves)
 
             adv_msg = ""
             if cust_id and bill_adv and bill_adv > 0:
@@ -873,9 +1024,7 @@ with tabs[3]:
 
             if saved:
                 st.success(f"Saved {saved} sale line(s){adv_msg}.")
-                st.session_state["rows_sale"] = [
-                    {"material": "", "product_name": "", "size": "", "unit": "", "qty": "", "rate": ""} for _ in range(6)
-                ]
+                st.session_state["rows_sale"] = _blank_rows()
                 _schedule_reset("bill_no_out", "customer_out", "sale_bill_adv")
                 st.rerun()
             else:
@@ -886,13 +1035,12 @@ with tabs[3]:
 # ===================== Payments & Balances =====================
 with tabs[4]:
     st.subheader("Record Payment / Opening Due")
-    custs = list_customers()
-    if not custs:
+    cmap = customer_choices()
+    if not cmap:
         st.info("Add a customer first.")
     else:
-        cmap = {c["name"]: c for c in custs}
         cname = st.selectbox("Customer", list(cmap.keys()), key="pay_cust")
-        cid = int(cmap[cname]["id"])
+        cid = int(cmap[cname])
         cur_bal = customer_balance(cid)
         if cur_bal >= 0:
             st.info(f"Current balance: ₹ {cur_bal:,.2f} (customer owes you)")
@@ -938,12 +1086,11 @@ with tabs[4]:
     st.subheader("Balances (Due or Advance)")
     cdf = customers_df()
     if not cdf.empty:
-        rows = []
-        for _, r in cdf.iterrows():
-            cid = int(r["id"])
-            bal = customer_balance(cid)
-            rows.append({"Customer": r["name"], "Phone": r["phone"], "Balance (+due / −adv)": bal})
-        bal_df = pd.DataFrame(rows).sort_values("Customer")
+        bal_df = pd.DataFrame({
+            "Customer": cdf["name"],
+            "Phone": cdf["phone"],
+            "Balance (+due / −adv)": cdf["id"].map(customer_balances()).fillna(0.0),
+        })
         st.dataframe(bal_df, use_container_width=True)
 
     st.divider()
@@ -952,7 +1099,6 @@ with tabs[4]:
     if not pays.empty and not cdf.empty:
         merged = pays.merge(cdf[["id", "name"]], left_on="customer_id", right_on="id", how="left")
         merged = merged.rename(columns={"name": "Customer"})
-        merged = merged.sort_values("ts")
         st.dataframe(merged[["ts", "Customer", "kind", "amount", "notes"]], use_container_width=True)
     elif pays.empty:
         st.info("No payments yet.")
@@ -961,18 +1107,12 @@ with tabs[4]:
 with tabs[6]:
     st.subheader("Daily Report (Sales, Purchases & Payments)")
     day = st.date_input("Pick a date", value=date.today())
-    start = datetime(day.year, day.month, day.day, 0, 0, 0)
-    end   = datetime(day.year, day.month, day.day, 23, 59, 59)
 
     # ---- Stock Moves ----
-    moves = stock_moves_df()
+    moves = stock_moves_on_day(day)
     if not moves.empty:
-        mv = moves.copy()
-        mv["ts_dt"] = _normalize_ts(mv["ts"])
-        mv = mv.dropna(subset=["ts_dt"])
-        start_dt = pd.Timestamp(start)
-        end_dt   = pd.Timestamp(end)
-        mv = mv[mv["ts_dt"].between(start_dt, end_dt, inclusive="both")].sort_values("ts_dt")
+        mv = moves
+        mv["time"] = _hhmm(mv["ts"])
 
         prods = products_df().rename(columns={"name": "product_name", "size": "product_size"})
         custs = customers_df().rename(columns={"id": "cust_id", "name": "customer_name"})
@@ -984,13 +1124,10 @@ with tabs[6]:
         )
         rep = rep.merge(custs[["cust_id","customer_name"]], left_on="customer_id", right_on="cust_id", how="left")
 
-        rep["time"] = rep["ts_dt"].dt.strftime("%H:%M")
-        rep["qty_display"] = rep.apply(lambda r: f'{abs(r["qty"])} {r.get("unit","")}', axis=1)
-        rep["value"] = rep.apply(lambda r: (abs(r["qty"]) * (r["price_per_unit"] or 0.0)), axis=1)
-        rep["Party"] = rep.apply(
-            lambda r: r["customer_name"] if r["kind"]=="sale" else r.get("supplier_name"),
-            axis=1
-        )
+        qty_abs = rep["qty"].abs()
+        rep["qty_display"] = qty_abs.astype(str) + " " + rep["unit"].fillna("").astype(str)
+        rep["value"] = qty_abs * rep["price_per_unit"].fillna(0.0)
+        rep["Party"] = rep["customer_name"].where(rep["kind"] == "sale")
 
         st.markdown("#### Movements Today")
         show = rep[["time","kind","product_name","product_size","qty_display","Party","price_per_unit","value","notes"]]
@@ -1007,55 +1144,42 @@ with tabs[6]:
         by_bill["Bill / Notes"] = by_bill["Bill / Notes"].fillna("N/A")
         st.dataframe(by_bill.sort_values(["kind","Bill / Notes"]), use_container_width=True)
 
-        sales = rep[rep["kind"]=="sale"].copy()
-        if not sales.empty:
+        is_sale = rep["kind"] == "sale"
+        if is_sale.any():
             st.markdown("#### Sales by Customer")
-            cust = sales.groupby("Party", dropna=False)["value"].sum().reset_index().rename(
-                columns={"Party":"Customer","value":"Total Amount"}
-            )
-            cust["Customer"] = cust["Customer"].fillna("N/A")
-            st.dataframe(cust.sort_values("Customer"), use_container_width=True)
+            # grouping on the filled name yields rows already sorted by customer
+            party = rep.loc[is_sale, "Party"].fillna("N/A").rename("Customer")
+            cust = rep.loc[is_sale, "value"].groupby(party).sum().reset_index(name="Total Amount")
+            st.dataframe(cust, use_container_width=True)
 
     # ---- Payments Today (Customers + Suppliers) ----
-    pays = payments_df()
+    pays = payments_on_day(day)
     if not pays.empty:
-        pp = pays.copy()
-        pp["ts_dt"] = _normalize_ts(pp["ts"])
-        pp = pp.dropna(subset=["ts_dt"])
-        start_dt = pd.Timestamp(start)
-        end_dt   = pd.Timestamp(end)
-        pp = pp[pp["ts_dt"].between(start_dt, end_dt, inclusive="both")]
-        if not pp.empty:
-            cdf = customers_df().rename(columns={"id":"cid"})
-            sdf = suppliers_df().rename(columns={"id":"sid"})
-            pp = pp.merge(cdf[["cid","name"]], left_on="customer_id", right_on="cid", how="left")
-            pp = pp.merge(sdf[["sid","name"]].rename(columns={"name":"supplier_name"}),
-                          left_on="supplier_id", right_on="sid", how="left")
-            pp["Party"] = pp.apply(
-                lambda r: r["name"] if pd.notna(r["name"]) else r["supplier_name"],
-                axis=1
-            )
-            pp["time"] = pp["ts_dt"].dt.strftime("%H:%M")
-            st.markdown("#### Payments / Advances Today")
-            st.dataframe(
-                pp[["time","Party","kind","amount","notes"]].rename(columns={"amount":"Amount"}),
-                use_container_width=True
-            )
+        pp = pays
+        pp["time"] = _hhmm(pp["ts"])
+        cdf = customers_df().rename(columns={"id":"cid"})
+        sdf = suppliers_df().rename(columns={"id":"sid"})
+        pp = pp.merge(cdf[["cid","name"]], left_on="customer_id", right_on="cid", how="left")
+        pp = pp.merge(sdf[["sid","name"]].rename(columns={"name":"supplier_name"}),
+                      left_on="supplier_id", right_on="sid", how="left")
+        pp["Party"] = pp["name"].fillna(pp["supplier_name"])
+        st.markdown("#### Payments / Advances Today")
+        st.dataframe(
+            pp[["time","Party","kind","amount","notes"]].rename(columns={"amount":"Amount"}),
+            use_container_width=True
+        )
 
     # ---- End-of-day Stock Snapshot ----
-    prods2 = list_products()
-    snap = [
-        {
-            "Product": p["name"],
-            "Size": p.get("size"),
-            "Unit": p["unit"],
-            "Stock Left": product_stock(int(p["id"])),
-            "Status": "NEGATIVE ⚠️" if product_stock(int(p["id"])) < 0 else ""
-        }
-        for p in prods2
-    ]
+    prods2 = products_with_stock()
+    snap = pd.DataFrame({
+        "Product": prods2["name"],
+        "Size": prods2["size"],
+        "Unit": prods2["unit"],
+        "Stock Left": prods2["current_stock"],
+        "Status": np.where(prods2["current_stock"] < 0, "NEGATIVE ⚠️", ""),
+    })
     st.markdown("#### Stock Snapshot (End of Day)")
-    st.dataframe(pd.DataFrame(snap).sort_values(["Size","Product"], na_position="last"), use_container_width=True)
+    st.dataframe(snap.sort_values(["Size","Product"], na_position="last"), use_container_width=True)
 
 st.divider()
 st.caption("Quick Bill uses a form that won’t refresh while typing. Click **Update Items** to apply changes. Per-row Amount and a grand Subtotal are shown for clarity.")
@@ -1,7 +1,9 @@
 # supabase_db.py — thin Supabase wrapper used by app.py
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import hashlib, secrets
+import hashlib, hmac, secrets
 from typing import List, Dict, Any
 
 try:
@@ -10,6 +12,12 @@ except Exception:
     create_client = None
     Client = None  # type: ignore
 
+__all__ = [
+    "TABLE_COLUMNS", "TABLE_DTYPES", "TABLE_ORDER", "SYNONYMS", "FETCH_PAGE_SIZE", "INSERT_BATCH_SIZE",
+    "PBKDF2_ITERATIONS", "ensure_all_tabs", "fetch_df", "fetch_range", "append_row", "append_rows",
+    "hash_password", "verify_password", "needs_rehash", "reset_or_create_user",
+]
+
 # === Canonical table schemas (match your Postgres table names exactly) ===
 TABLE_COLUMNS: Dict[str, List[str]] = {
     "users":       ["id", "username", "password_hash", "salt"],
@@ -20,6 +28,38 @@ TABLE_COLUMNS: Dict[str, List[str]] = {
     "stock_moves": ["id", "ts", "kind", "product_id", "qty", "price_per_unit", "customer_id", "notes"],
 }
 
+# Numeric dtypes applied once when a frame is built; everything else stays as PostgREST sent it
+TABLE_DTYPES: Dict[str, Dict[str, str]] = {
+    "users":       {"id": "Int64"},
+    "products":    {"id": "Int64", "opening_stock": "float64"},
+    "customers":   {"id": "Int64"},
+    "suppliers":   {"id": "Int64"},
+    "payments":    {"id": "Int64", "customer_id": "Int64", "supplier_id": "Int64", "amount": "float64"},
+    "stock_moves": {"id": "Int64", "product_id": "Int64", "customer_id": "Int64",
+                    "qty": "float64", "price_per_unit": "float64"},
+}
+
+# select() lists built once; only the canonical columns travel over the wire
+_SELECT_COLUMNS: Dict[str, str] = {t: ",".join(cols) for t, cols in TABLE_COLUMNS.items()}
+
+# Indexes backing the server-side filters/orders below (create once in the Supabase SQL editor):
+#   create index if not exists idx_moves_ts         on stock_moves (ts);
+#   create index if not exists idx_moves_product    on stock_moves (product_id);
+#   create index if not exists idx_moves_customer   on stock_moves (customer_id);
+#   create index if not exists idx_moves_product_ts on stock_moves (product_id, ts);
+#   create index if not exists idx_payments_ts      on payments (ts);
+#   create unique index if not exists uq_users_username on users (username);  -- lets reset_or_create_user upsert
+
+# Row order fetch_df/fetch_range return per table (rows are paged by id, then sorted once in pandas)
+TABLE_ORDER: Dict[str, str] = {
+    "users":       "id",
+    "products":    "name",
+    "customers":   "name",
+    "suppliers":   "name",
+    "payments":    "ts",
+    "stock_moves": "ts",
+}
+
 # Allow legacy names / variants
 SYNONYMS: Dict[str, list[str]] = {
     "users":       ["Users"],
@@ -30,60 +70,108 @@ SYNONYMS: Dict[str, list[str]] = {
     "stock_moves": ["StockMoves", "stockmoves", "stock-moves"],
 }
 
+# PostgREST silently caps each response at the project's max-rows (1000 by default), so reads
+# page by id; keep this at or below that setting
+FETCH_PAGE_SIZE = 1000
+# rows per insert request in append_rows; keeps bulk request bodies and statement size bounded
+INSERT_BATCH_SIZE = 500
+
+PBKDF2_ITERATIONS = 600_000
+PBKDF2_LEGACY_ITERATIONS = 100_000  # bare-hex hashes stored before the iteration count was encoded
+_PBKDF2_MAX_ITERATIONS = 10 * PBKDF2_ITERATIONS  # stored counts above this are treated as corrupt
+_HASH_PREFIX = "pbkdf2_sha256"
+
+# Postgres errors (SQLSTATE, plus text for clients without APIError.code) that tell append_row
+# how a table's id column is generated
+_ID_GENERATED_ALWAYS_CODE = "428C9"
+_ID_GENERATED_ALWAYS_MARKERS = (_ID_GENERATED_ALWAYS_CODE, "GENERATED ALWAYS", 'non-DEFAULT value into column "id"')
+_ID_NOT_NULL_CODE = "23502"
+_UNDEFINED_COLUMN_CODE = "42703"
+_NO_CONFLICT_TARGET_CODE = "42P10"  # ON CONFLICT column has no unique index
+_UNIQUE_VIOLATION_CODE = "23505"
+_ID_COLUMN_MARKER = 'column "id"'
+_ID_NULL_MARKER = 'null value in column "id"'
+
 _client_cache = None
+_client_lock = threading.Lock()
+
+# per table, learned from the first rejected insert: "omit" = id is GENERATED ALWAYS, never send one;
+# "assign" = id has no default, number new rows client-side
+_id_strategy: Dict[str, str] = {}
+
+# next free id per table whose id column has no default; seeded from max(id), then bumped locally
+_next_ids: Dict[str, int] = {}
+_next_ids_lock = threading.Lock()
 
 def _norm_name(name: str) -> str:
     return (name or "").strip().lower()
 
+def _compact(n: str) -> str:
+    return n.replace("_", "").replace("-", "")
+
+# every accepted spelling (normalized, and with _/- removed) -> canonical table name, built once
+_CANON_MAP: Dict[str, str] = {}
+for _t, _alts in SYNONYMS.items():
+    for _a in [_t] + _alts:
+        _CANON_MAP.setdefault(_norm_name(_a), _t)
+        _CANON_MAP.setdefault(_compact(_norm_name(_a)), _t)
+for _t in TABLE_COLUMNS:
+    _CANON_MAP[_t] = _t
+del _t, _alts, _a
+
 def _canon(name: str) -> str:
     n = _norm_name(name)
-    if n in TABLE_COLUMNS:
-        return n
-    compact = n.replace("_", "").replace("-", "")
-    for canon, alts in SYNONYMS.items():
-        all_names = [canon] + alts
-        for a in all_names:
-            a_norm = _norm_name(a)
-            if n == a_norm or compact == a_norm.replace("_", "").replace("-", ""):
-                return canon
-    raise ValueError(f"Unknown table: {name}")
+    t = _CANON_MAP.get(n) or _CANON_MAP.get(_compact(n))
+    if t is None:
+        raise ValueError(f"Unknown table: {name}")
+    return t
 
 def _is_blank(v: Any) -> bool:
-    if v is None:
-        return True
-    if isinstance(v, str) and v == "":
-        return True
-    try:
-        return pd.isna(v)
-    except Exception:
-        return False
+    # plain identity/type checks cover what row values hold (None, "", NaN, pd.NA, NaT);
+    # NaN is the only value not equal to itself
+    return (v is None or v is pd.NA or v is pd.NaT
+            or (isinstance(v, str) and v == "")
+            or (isinstance(v, float) and v != v))
 
 def _noneify(v: Any):
-    try:
-        if pd.isna(v):
-            return None
-    except Exception:
-        pass
-    if isinstance(v, str) and v == "":
-        return None
-    return v
+    return None if _is_blank(v) else v
 
 def _client():
+    # One client (and its HTTP connection pool) per process. Streamlit runs each session's
+    # script in its own thread, so creation is guarded to avoid racing sessions building extras.
     global _client_cache
     if _client_cache is not None:
         return _client_cache
 
-    url = os.getenv("SUPABASE_URL", "")
-    key = (
-        os.getenv("SUPABASE_KEY")
-        or os.getenv("SUPABASE_ANON_KEY")
-        or os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-        or ""
-    )
-    if not create_client or not url or not key:
-        raise RuntimeError("Supabase credentials not configured (SUPABASE_URL / SUPABASE_KEY).")
-    _client_cache = create_client(url, key)
-    return _client_cache
+    with _client_lock:
+        if _client_cache is not None:
+            return _client_cache
+        url = os.getenv("SUPABASE_URL", "")
+        key = (
+            os.getenv("SUPABASE_KEY")
+            or os.getenv("SUPABASE_ANON_KEY")
+            or os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+            or ""
+        )
+        if not create_client or not url or not key:
+            raise RuntimeError("Supabase credentials not configured (SUPABASE_URL / SUPABASE_KEY).")
+        _client_cache = create_client(url, key)
+        return _client_cache
+
+# Optional one-round-trip existence check used by ensure_all_tabs (create once in the SQL editor):
+#   create or replace function tables_exist(names text[]) returns setof text
+#   language sql stable as $$
+#     select table_name::text from information_schema.tables
+#     where table_schema = 'public' and table_name = any(names)
+#   $$;
+def _missing_tables_rpc(sb) -> List[str] | None:
+    """Missing table names via the tables_exist RPC, or None when the function isn't installed."""
+    try:
+        resp = sb.rpc("tables_exist", {"names": list(TABLE_COLUMNS)}).execute()
+    except Exception:
+        return None
+    present = {r if isinstance(r, str) else next(iter(r.values()), None) for r in (resp.data or [])}
+    return [t for t in TABLE_COLUMNS if t not in present]
 
 def ensure_all_tabs():
     try:
@@ -91,35 +179,121 @@ def ensure_all_tabs():
     except RuntimeError as e:
         print(f"[ensure_all_tabs] Skipped: {e}")
         return
-    for canon in TABLE_COLUMNS.keys():
+    missing = _missing_tables_rpc(sb)
+    if missing is not None:
+        for canon in missing:
+            print(f"[ensure_all_tabs] Warning: table {canon} not found")
+        return
+
+    def _probe(canon: str) -> Exception | None:
         try:
-            _ = sb.table(canon).select("*").limit(1).execute()
+            # HEAD request: PostgREST checks the table and sends no rows back
+            sb.table(canon).select("id", head=True).limit(1).execute()
+            return None
         except Exception as e:
+            return e
+
+    # the probes are independent round-trips, so run them side by side
+    with ThreadPoolExecutor(max_workers=len(TABLE_COLUMNS)) as ex:
+        errors = list(ex.map(_probe, TABLE_COLUMNS))
+    for canon, e in zip(TABLE_COLUMNS, errors):
+        if e is not None:
             print(f"[ensure_all_tabs] Warning touching table {canon}: {e}")
 
-def fetch_df(table_name: str) -> pd.DataFrame:
+def _to_df(t: str, data: List[Dict[str, Any]], cols: List[str] | None = None) -> pd.DataFrame:
+    # transpose PostgREST's row dicts into one list per column (canonical unless projected);
+    # absent keys come back empty
+    if cols is None:
+        cols, dtypes = TABLE_COLUMNS[t], TABLE_DTYPES[t]
+    else:
+        dtypes = {c: dt for c, dt in TABLE_DTYPES[t].items() if c in cols}
+    values = {c: [r.get(c) for r in data] for c in cols}
+    try:
+        # numeric columns are built straight into their declared dtype, with no object-dtype pass first
+        return pd.DataFrame({c: pd.Series(v, dtype=dtypes.get(c)) for c, v in values.items()}, columns=cols)
+    except (TypeError, ValueError):
+        # text in a numeric column becomes NaN/<NA>, and so does a fractional value in an
+        # integer column (Int64 refuses to truncate it); the rest of the table still loads
+        df = pd.DataFrame(values, columns=cols)
+        for c, dt in dtypes.items():
+            s = pd.to_numeric(df[c], errors="coerce")
+            if dt == "Int64":
+                s = s.where(s.mod(1).eq(0))
+            df[c] = s.astype(dt)
+        return df
+
+def _fetch_all_pages(build) -> List[Dict[str, Any]]:
+    """
+    Every row of the query returned by build(), one FETCH_PAGE_SIZE page per request.
+    Keyset paging (id > last id seen) lets each page start from the primary-key index
+    instead of re-walking the skipped rows the way OFFSET does.
+    """
+    rows: List[Dict[str, Any]] = []
+    last_id = None
+    while True:
+        q = build().order("id").limit(FETCH_PAGE_SIZE)
+        if last_id is not None:
+            q = q.gt("id", last_id)
+        page = q.execute().data or []
+        rows.extend(page)
+        if len(page) < FETCH_PAGE_SIZE:
+            return rows
+        last_id = page[-1]["id"]
+
+def _sorted(t: str, df: pd.DataFrame) -> pd.DataFrame:
+    # stable sort keeps id order among ties; lower() approximates Postgres' case-insensitive collation
+    col = TABLE_ORDER[t]
+    if col == "id" or df.empty:
+        return df
+    return df.sort_values(col, key=lambda s: s.astype("string").str.lower(),
+                          kind="stable", na_position="last", ignore_index=True)
+
+def _select_all(sb, t: str, refine, cols: List[str] | None = None) -> List[Dict[str, Any]]:
+    """
+    All rows of refine(select(...)), asking for cols (default: the canonical columns) only,
+    or "*" if the table lacks one of them.
+    """
+    spec = _SELECT_COLUMNS[t] if cols is None else ",".join(cols)
+    try:
+        return _fetch_all_pages(lambda: refine(sb.table(t).select(spec)))
+    except Exception as e:
+        if not _has_code(e, _UNDEFINED_COLUMN_CODE):
+            raise
+        return _fetch_all_pages(lambda: refine(sb.table(t).select("*")))
+
+def fetch_df(table_name: str, columns: List[str] | None = None) -> pd.DataFrame:
+    """Table rows in TABLE_ORDER; columns projects the select to just those columns."""
     t = _canon(table_name)
+    # paging needs id and sorting needs the order column, so fetch them even when not asked for
+    cols = list(dict.fromkeys(["id", TABLE_ORDER[t], *columns])) if columns else None
+    pick = (lambda df: df[list(dict.fromkeys(columns))]) if columns else (lambda df: df)
+
     try:
         sb = _client()
     except RuntimeError as e:
         print(f"[fetch_df] Skipped ({t}): {e}")
-        return pd.DataFrame(columns=TABLE_COLUMNS[t])
+        return pick(_to_df(t, [], cols))
     try:
-        resp = sb.table(t).select("*").execute()
-        data = resp.data or []
-        df = pd.DataFrame(data)
-        cols = TABLE_COLUMNS[t]
-        for c in cols:
-            if c not in df.columns:
-                df[c] = pd.NA
-        return df[cols]
+        return pick(_sorted(t, _to_df(t, _select_all(sb, t, lambda q: q, cols), cols)))
     except Exception as e:
         print(f"[fetch_df] {t}: {e}")
-        return pd.DataFrame(columns=TABLE_COLUMNS[t])
+        return pick(_to_df(t, [], cols))
 
-def _next_id(table_name: str, sb: Client | None = None) -> int:
+def fetch_range(table_name: str, column: str, lo: Any, hi: Any) -> pd.DataFrame:
+    """Rows with lo <= column < hi, filtered server-side."""
     t = _canon(table_name)
-    sb = sb or _client()
+    try:
+        sb = _client()
+    except RuntimeError as e:
+        print(f"[fetch_range] Skipped ({t}): {e}")
+        return _to_df(t, [])
+    try:
+        return _sorted(t, _to_df(t, _select_all(sb, t, lambda q: q.gte(column, lo).lt(column, hi))))
+    except Exception as e:
+        print(f"[fetch_range] {t}: {e}")
+        return _to_df(t, [])
+
+def _max_id_plus_one(t: str, sb) -> int:
     try:
         resp = sb.table(t).select("id").order("id", desc=True).limit(1).execute()
         if resp.data and resp.data[0].get("id") is not None:
@@ -128,53 +302,173 @@ def _next_id(table_name: str, sb: Client | None = None) -> int:
         pass
     return 1
 
-def append_row(table_name: str, row_values: List[Any]) -> None:
+def _next_id(table_name: str, sb: Client | None = None, count: int = 1) -> int:
+    """First of `count` consecutive unused ids; only the first call per table asks Supabase for max(id)."""
     t = _canon(table_name)
-    sb = _client()
+    with _next_ids_lock:
+        if t not in _next_ids:
+            _next_ids[t] = _max_id_plus_one(t, sb or _client())
+        nid = _next_ids[t]
+        _next_ids[t] = nid + count
+        return nid
+
+def _forget_next_id(t: str) -> None:
+    with _next_ids_lock:
+        _next_ids.pop(t, None)
+
+def _build_record(t: str, row_values: List[Any], fn: str) -> Dict[str, Any]:
+    """Canonical column -> value record; "id" is kept only when it holds a usable integer."""
     cols = TABLE_COLUMNS[t]
     if len(row_values) != len(cols):
-        raise ValueError(f"append_row: expected {len(cols)} values for table {t}, got {len(row_values)}")
+        raise ValueError(f"{fn}: expected {len(cols)} values for table {t}, got {len(row_values)}")
 
     rec = {c: _noneify(v) for c, v in zip(cols, row_values)}
+    rid = rec.pop("id", None)
+    if not _is_blank(rid):
+        try:
+            rec["id"] = int(rid)
+        except Exception:
+            pass
+    return rec
 
-    include_id = False
-    if "id" in rec:
-        if _is_blank(rec["id"]):
-            include_id = False
-        else:
-            try:
-                rec["id"] = int(rec["id"])
-                include_id = True
-            except Exception:
-                include_id = False
+def _error_code(e: Exception) -> str | None:
+    code = getattr(e, "code", None)  # postgrest APIError carries the SQLSTATE
+    return str(code) if code else None
 
-    payload_no_id = {k: v for k, v in rec.items() if k != "id"}
-    payload_with_id = rec
+def _has_code(e: Exception, *codes: str) -> bool:
+    code = _error_code(e)
+    if code is not None:
+        return code in codes
+    msg = str(e)  # clients that don't surface .code: the SQLSTATE only appears in the text
+    return any(c in msg for c in codes)
 
+def _is_id_generated_always(e: Exception) -> bool:
+    code = _error_code(e)
+    if code is not None:
+        return code == _ID_GENERATED_ALWAYS_CODE
+    return any(m in str(e) for m in _ID_GENERATED_ALWAYS_MARKERS)
+
+def _is_id_missing(e: Exception) -> bool:
+    code = _error_code(e)
+    text = " ".join(str(x) for x in (getattr(e, "message", None), getattr(e, "details", None)) if x) or str(e)
+    if code is not None:
+        return code == _ID_NOT_NULL_CODE and _ID_COLUMN_MARKER in text
+    return (_ID_NOT_NULL_CODE in text and _ID_COLUMN_MARKER in text) or (_ID_NULL_MARKER in text)
+
+def _insert_records(t: str, sb, recs: List[Dict[str, Any]], fn: str,
+                    returning: str = "representation") -> List[Dict[str, Any]]:
+    """
+    One insert request for all recs. The first rejection that shows how the table generates ids
+    is retried to fit, and the outcome is remembered so later inserts go right the first time.
+    """
     def _insert(payload):
-        return sb.table(t).insert(payload).execute()
+        resp = sb.table(t).insert(payload, returning=returning).execute()
+        return getattr(resp, "data", None) or []
+
+    def _without_ids():
+        return [{k: v for k, v in r.items() if k != "id"} for r in recs]
+
+    def _with_ids():
+        nid = _next_id(t, sb, count=sum(1 for r in recs if "id" not in r))
+        payload = []
+        for r in recs:
+            if "id" not in r:
+                r = {**r, "id": nid}
+                nid += 1
+            payload.append(r)
+        return payload
+
+    def _insert_with_ids():
+        try:
+            return _insert(_with_ids())
+        except Exception as e:
+            if not _has_code(e, _UNIQUE_VIOLATION_CODE):
+                raise
+            # another process used those ids: re-read max(id) and try once more
+            _forget_next_id(t)
+            return _insert(_with_ids())
 
+    strategy = _id_strategy.get(t)
     try:
-        _insert(payload_with_id if include_id else payload_no_id)
-        return
+        if strategy == "omit":
+            return _insert(_without_ids())
+        if strategy == "assign":
+            return _insert_with_ids()
+        return _insert(recs)
     except Exception as e1:
-        msg = str(e1)
-        if ('428C9' in msg) or ('GENERATED ALWAYS' in msg) or ('non-DEFAULT value into column \"id\"' in msg):
-            try:
-                _insert(payload_no_id)
-                return
-            except Exception as e2:
-                raise RuntimeError(f"append_row failed for {t}: {e2}") from e2
-        if ('23502' in msg and 'column \"id\"' in msg) or ('null value in column \"id\"' in msg):
-            try:
-                nid = _next_id(t, sb)
-                payload_with_id2 = dict(payload_with_id)
-                payload_with_id2["id"] = nid
-                _insert(payload_with_id2)
-                return
-            except Exception as e2:
-                raise RuntimeError(f"append_row failed for {t}: {e2}") from e2
-        raise RuntimeError(f"append_row failed for {t}: {e1}") from e1
+        if strategy is None and _is_id_generated_always(e1):
+            retry, learned = _without_ids, "omit"
+        elif strategy is None and _is_id_missing(e1):
+            retry, learned = None, "assign"
+        else:
+            raise RuntimeError(f"{fn} failed for {t}: {e1}") from e1
+        try:
+            data = _insert(retry()) if retry else _insert_with_ids()
+        except Exception as e2:
+            raise RuntimeError(f"{fn} failed for {t}: {e2}") from e2
+        _id_strategy[t] = learned
+        return data
+
+def _append(table_name: str, rows: List[List[Any]], fn: str, returning: str) -> List[Dict[str, Any]]:
+    # shared by append_row/append_rows; fn names the public entry point in error messages
+    t = _canon(table_name)
+    if not rows:
+        return []
+    sb = _client()
+    recs = [_build_record(t, r, fn) for r in rows]
+    out: List[Dict[str, Any]] = []
+    for i in range(0, len(recs), INSERT_BATCH_SIZE):
+        out.extend(_insert_records(t, sb, recs[i:i + INSERT_BATCH_SIZE], fn, returning=returning))
+    return out
+
+def append_rows(table_name: str, rows: List[List[Any]],
+                returning: str = "representation") -> List[Dict[str, Any]]:
+    """
+    Insert several rows, one PostgREST request per INSERT_BATCH_SIZE rows; returns the inserted records.
+    returning="minimal" skips echoing them back (returns []) when the caller has no use for ids.
+    """
+    return _append(table_name, rows, "append_rows", returning)
+
+def append_row(table_name: str, row_values: List[Any],
+               returning: str = "representation") -> Dict[str, Any] | None:
+    """Insert one row; returns the inserted record as echoed back by PostgREST (None if not echoed)."""
+    data = _append(table_name, [row_values], "append_row", returning)
+    return data[0] if data else None
+
+def _pbkdf2_hex(password: str, salt: bytes, iterations: int) -> str:
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations).hex()
+
+def hash_password(password: str, salt: str) -> str:
+    """PBKDF2-HMAC-SHA256 (OpenSSL-backed via hashlib) of password with a hex salt, as
+    'pbkdf2_sha256$<iterations>$<hex>' so the work factor can be raised later."""
+    return f"{_HASH_PREFIX}${PBKDF2_ITERATIONS}${_pbkdf2_hex(password, bytes.fromhex(salt), PBKDF2_ITERATIONS)}"
+
+def verify_password(password: str, salt: str, stored: str) -> bool:
+    """Check password against a stored hash in constant time; bare hex is a legacy 100k-iteration hash."""
+    stored = str(stored or "")
+    try:
+        salt_bytes = bytes.fromhex(str(salt or ""))
+    except ValueError:
+        return False
+    parts = stored.split("$")
+    if len(parts) == 3 and parts[0] == _HASH_PREFIX and parts[1].isdigit():
+        iterations, expected = int(parts[1]), parts[2]
+    else:
+        iterations, expected = PBKDF2_LEGACY_ITERATIONS, stored
+    # a corrupt row must fail the login, not raise (0 iterations) or stall it (a huge count)
+    if not 1 <= iterations <= _PBKDF2_MAX_ITERATIONS:
+        return False
+    try:
+        return hmac.compare_digest(_pbkdf2_hex(password, salt_bytes, iterations), expected)
+    except (TypeError, ValueError):  # e.g. non-ASCII text in the stored hash
+        return False
+
+def needs_rehash(stored: str) -> bool:
+    """True when a stored hash uses fewer iterations than PBKDF2_ITERATIONS."""
+    parts = str(stored or "").split("$")
+    if len(parts) == 3 and parts[0] == _HASH_PREFIX and parts[1].isdigit():
+        return int(parts[1]) < PBKDF2_ITERATIONS
+    return True
 
 def reset_or_create_user(username: str, password: str) -> None:
     t = "users"
@@ -182,12 +476,18 @@ def reset_or_create_user(username: str, password: str) -> None:
     u = (username or "").strip().lower()
 
     salt = secrets.token_hex(16)
-    pwd_hash = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt), 100_000).hex()
+    pwd_hash = hash_password(password, salt)
 
+    # one round-trip when users.username is uniquely indexed and id is generated by the database
     try:
-        resp = sb.table(t).update({"salt": salt, "password_hash": pwd_hash}).eq("username", u).execute()
-        if getattr(resp, "data", None):
-            return
-    except Exception:
-        pass
-    append_row("users", [None, u, pwd_hash, salt])
+        sb.table(t).upsert({"username": u, "password_hash": pwd_hash, "salt": salt},
+                           on_conflict="username", returning="minimal").execute()
+        return
+    except Exception as e:
+        if not _has_code(e, _NO_CONFLICT_TARGET_CODE, _ID_NOT_NULL_CODE):
+            raise
+
+    resp = sb.table(t).update({"salt": salt, "password_hash": pwd_hash}).eq("username", u).execute()
+    if getattr(resp, "data", None):
+        return
+    append_row("users", [None, u, pwd_hash, salt], returning="minimal")
@@ -1,5 +1,6 @@
-import secrets, hashlib
+import secrets
+from supabase_db import hash_password
 salt = secrets.token_hex(16)
 pwd = "1234"
-hash_hex = hashlib.pbkdf2_hmac("sha256", pwd.encode(), bytes.fromhex(salt), 100_000).hex()
+hash_hex = hash_password(pwd, salt)
 print(salt, hash_hex)